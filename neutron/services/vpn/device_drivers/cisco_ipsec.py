@@ -367,22 +367,22 @@ class CiscoCsrIPsecDriver(device_drivers.DeviceDriver):
         report info will be created for the connection. The combined report
         data is returned.
         """
-        LOG.debug(_("Report: Collecting status for IPSec connections on VPN "
-                    "service %s"), vpn_service.service_id)
+        LOG.debug("Report: Collecting status for IPSec connections on VPN "
+                  "service %s", vpn_service.service_id)
         tunnels = vpn_service.get_ipsec_connections_status()
         report = {}
         for connection in vpn_service.conn_state.values():
             if connection.forced_down:
-                LOG.debug(_("Connection %s forced down"), connection.conn_id)
+                LOG.debug("Connection %s forced down", connection.conn_id)
                 current_status = constants.DOWN
             else:
                 current_status = connection.find_current_status_in(tunnels)
-                LOG.debug(_("Connection %(conn)s reported %(status)s"),
+                LOG.debug("Connection %(conn)s reported %(status)s",
                           {'conn': connection.conn_id,
                            'status': current_status})
             frag = connection.update_status_and_build_report(current_status)
             if frag:
-                LOG.debug(_("Report: Adding info for IPSec connection %s"),
+                LOG.debug("Report: Adding info for IPSec connection %s",
                           connection.conn_id)
                 report.update(frag)
         return report
@@ -402,7 +402,7 @@ class CiscoCsrIPsecDriver(device_drivers.DeviceDriver):
             pending_handled = plugin_utils.in_pending_status(
                 vpn_service.last_status)
             vpn_service.update_last_status()
-            LOG.debug(_("Report: Adding info for VPN service %s"),
+            LOG.debug("Report: Adding info for VPN service %s",
                       vpn_service.service_id)
             return {u'id': vpn_service.service_id,
                     u'status': vpn_service.last_status,
@@ -424,9 +424,9 @@ class CiscoCsrIPsecDriver(device_drivers.DeviceDriver):
     def report_status_internal(self, context):
         """Generate report and send to plugin, if anything changed."""
         service_report = []
-        LOG.debug(_("Report: Starting status report processing"))
+        LOG.debug("Report: Starting status report processing")
         for vpn_service_id, vpn_service in self.service_state.items():
-            LOG.debug(_("Report: Collecting status for VPN service %s"),
+            LOG.debug("Report: Collecting status for VPN service %s",
                       vpn_service_id)
             report = self.build_report_for_service(vpn_service)
             if report:
@@ -434,7 +434,7 @@ class CiscoCsrIPsecDriver(device_drivers.DeviceDriver):
         if service_report:
             LOG.info(_("Sending status report update to plugin"))
             self.agent_rpc.update_status(context, service_report)
-        LOG.debug(_("Report: Completed status report processing"))
+        LOG.debug("Report: Completed status report processing")
         return service_report
 
     @lockutils.synchronized('vpn-agent', 'neutron-')
@@ -612,16 +612,29 @@ class CiscoCsrIPSecConnection(object):
                                     'group5': u'group5',
                                     'group14': u'group14'}}
 
+    # DIALECT_MAP flattened for lookup by (resource, value)
+    _RESOURCE_NAMES = dict((resource, mapping['name'])
+                           for resource, mapping in DIALECT_MAP.items())
+    _FLAT_DIALECT_MAP = dict(((resource, value), csr_value)
+                             for resource, mapping in DIALECT_MAP.items()
+                             for value, csr_value in mapping.items()
+                             if value != 'name')
+
     def translate_dialect(self, resource, attribute, info):
         """Map VPNaaS attributes values to CSR values for a resource."""
-        name = self.DIALECT_MAP[resource]['name']
-        if attribute not in info:
-            raise CsrDriverMismatchError(resource=name, attr=attribute)
-        value = info[attribute].lower()
-        if value in self.DIALECT_MAP[resource]:
-            return self.DIALECT_MAP[resource][value]
-        raise CsrUnknownMappingError(resource=name, attr=attribute,
-                                     value=value)
+        try:
+            value = info[attribute]
+        except KeyError:
+            raise CsrDriverMismatchError(
+                resource=self._RESOURCE_NAMES[resource], attr=attribute)
+        if not value.islower():
+            value = value.lower()
+        try:
+            return self._FLAT_DIALECT_MAP[(resource, value)]
+        except KeyError:
+            raise CsrUnknownMappingError(
+                resource=self._RESOURCE_NAMES[resource], attr=attribute,
+                value=value)
 
     def create_psk_info(self, psk_id, conn_info):
         """Collect/create attributes needed for pre-shared key."""
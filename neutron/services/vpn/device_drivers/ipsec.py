@@ -13,13 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 import abc
-import copy
+import errno
+import hashlib
+import io
+import itertools
 import os
 import re
-import shutil
+import sys
 
+import eventlet
+import eventlet.event
 import jinja2
-import netaddr
 from oslo.config import cfg
 from oslo import messaging
 import six
@@ -28,9 +32,8 @@ from neutron.agent.linux import ip_lib
 from neutron.agent.linux import utils
 from neutron.common import rpc as n_rpc
 from neutron import context
-from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
-from neutron.openstack.common import loopingcall
+from neutron.openstack.common import uuidutils
 from neutron.plugins.common import constants
 from neutron.plugins.common import utils as plugin_utils
 from neutron.services.vpn.common import topics
@@ -46,7 +49,13 @@ ipsec_opts = [
         help=_('Location to store ipsec server config files')),
     cfg.IntOpt('ipsec_status_check_interval',
                default=60,
-               help=_("Interval for checking ipsec status"))
+               help=_("Interval for checking ipsec status")),
+    cfg.IntOpt('ipsec_status_check_max_interval',
+               default=60,
+               help=_("Maximum interval for checking ipsec status. The "
+                      "interval is doubled, up to this value, each time "
+                      "a check finds no status change. No backoff is done "
+                      "unless this is above ipsec_status_check_interval"))
 ]
 cfg.CONF.register_opts(ipsec_opts, 'ipsec')
 
@@ -67,7 +76,7 @@ openswan_opts = [
 
 cfg.CONF.register_opts(openswan_opts, 'openswan')
 
-JINJA_ENV = None
+_TEMPLATE_CACHE = {}
 
 STATUS_MAP = {
     'erouted': constants.ACTIVE,
@@ -76,13 +85,53 @@ STATUS_MAP = {
 
 IPSEC_CONNS = 'ipsec_site_connections'
 
+# Config dirs are renamed with this marker before being deleted
+DELETED_DIR_MARKER = '.deleted-'
+
+# Upper bound on commands run concurrently for a single process
+MAX_CONCURRENT_COMMANDS = 16
+
+# Matches connection state lines in 'ipsec whack --status' output. The
+# pattern cannot span lines, so it is applied to the whole output at once.
+_STATUS_RE = re.compile(
+    r'\d\d\d "(?P<id>[a-f0-9\-]+).* (?P<status>unrouted|erouted);')
+
+# Matches the gateway in 'ip route get' output
+_NEXTHOP_RE = re.compile(r'\bvia\s+(\S+)')
+
 
 def _get_template(template_file):
-    global JINJA_ENV
-    if not JINJA_ENV:
-        templateLoader = jinja2.FileSystemLoader(searchpath="/")
-        JINJA_ENV = jinja2.Environment(loader=templateLoader)
-    return JINJA_ENV.get_template(template_file)
+    """Return the compiled template, loading it only on first use.
+
+    Template paths come from configuration and do not change while the
+    agent is running, so the template is compiled once and kept in memory
+    instead of being stat'ed and looked up through a loader on every call.
+    """
+    template = _TEMPLATE_CACHE.get(template_file)
+    if template is None:
+        with io.open(template_file, encoding='utf-8') as f:
+            template = jinja2.Template(f.read())
+        _TEMPLATE_CACHE[template_file] = template
+    return template
+
+
+def _remove_dir(dir_path):
+    # A single 'rm -rf' is much cheaper than walking the tree in Python.
+    # The agent owns the config dirs, so no root helper is needed (and
+    # rootwrap has no filter for rm).
+    utils.execute(['rm', '-rf', dir_path], check_exit_code=False)
+
+
+def remove_deleted_config_dirs():
+    """Clean up config dirs left behind by an earlier agent run."""
+    base_dir = cfg.CONF.ipsec.config_base_dir
+    try:
+        dir_names = os.listdir(base_dir)
+    except OSError:
+        return
+    for dir_name in dir_names:
+        if DELETED_DIR_MARKER in dir_name:
+            eventlet.spawn_n(_remove_dir, os.path.join(base_dir, dir_name))
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -94,10 +143,10 @@ class BaseSwanProcess():
     """
 
     binary = "ipsec"
+    # Only leaf dirs are listed, parents are created along with them
     CONFIG_DIRS = [
         'var/run',
         'log',
-        'etc',
         'etc/ipsec.d/aacerts',
         'etc/ipsec.d/acerts',
         'etc/ipsec.d/cacerts',
@@ -125,6 +174,11 @@ class BaseSwanProcess():
         "v1": "never"
     }
 
+    # Attributes translated with DIALECT_MAP
+    CONNECTION_DIALECT_KEYS = ('initiator',)
+    POLICY_DIALECT_KEYS = ('encryption_algorithm', 'auth_algorithm', 'pfs')
+    IKE_POLICY_DIALECT_KEYS = POLICY_DIALECT_KEYS + ('ike_version',)
+
     def __init__(self, conf, root_helper, process_id,
                  vpnservice, namespace):
         self.conf = conf
@@ -133,29 +187,34 @@ class BaseSwanProcess():
         self.updated_pending_status = False
         self.namespace = namespace
         self.connection_status = {}
+        # Digests of the last written content, keyed by config file kind
+        self._config_digests = {}
         self.config_dir = os.path.join(
             cfg.CONF.ipsec.config_base_dir, self.id)
         self.etc_dir = os.path.join(self.config_dir, 'etc')
+        self.config_subdirs = tuple(os.path.join(self.config_dir, subdir)
+                                    for subdir in self.CONFIG_DIRS)
         self.update_vpnservice(vpnservice)
 
     def translate_dialect(self):
         if not self.vpnservice:
             return
         for ipsec_site_conn in self.vpnservice['ipsec_site_connections']:
-            self._dialect(ipsec_site_conn, 'initiator')
-            self._dialect(ipsec_site_conn['ikepolicy'], 'ike_version')
-            for key in ['encryption_algorithm',
-                        'auth_algorithm',
-                        'pfs']:
-                self._dialect(ipsec_site_conn['ikepolicy'], key)
-                self._dialect(ipsec_site_conn['ipsecpolicy'], key)
+            self._dialect(ipsec_site_conn, self.CONNECTION_DIALECT_KEYS)
+            self._dialect(ipsec_site_conn['ikepolicy'],
+                          self.IKE_POLICY_DIALECT_KEYS)
+            self._dialect(ipsec_site_conn['ipsecpolicy'],
+                          self.POLICY_DIALECT_KEYS)
 
     def update_vpnservice(self, vpnservice):
         self.vpnservice = vpnservice
         self.translate_dialect()
 
-    def _dialect(self, obj, key):
-        obj[key] = self.DIALECT_MAP.get(obj[key], obj[key])
+    def _dialect(self, obj, keys):
+        dialect_map = self.DIALECT_MAP
+        for key in keys:
+            value = obj[key]
+            obj[key] = dialect_map.get(value, value)
 
     @abc.abstractmethod
     def ensure_configs(self):
@@ -164,26 +223,47 @@ class BaseSwanProcess():
     def ensure_config_file(self, kind, template, vpnservice):
         """Update config file,  based on current settings for service."""
         config_str = self._gen_config_content(template, vpnservice)
+        digest = hashlib.sha1(config_str.encode('utf-8')).digest()
+        if self._config_digests.get(kind) == digest:
+            return
         config_file_name = self._get_config_filename(kind)
         utils.replace_file(config_file_name, config_str)
+        self._config_digests[kind] = digest
 
     def remove_config(self):
-        """Remove whole config file."""
-        shutil.rmtree(self.config_dir, ignore_errors=True)
+        """Remove whole config file.
+
+        The config dir is moved out of the way first, so that the actual
+        deletion can happen in the background.
+        """
+        self._config_digests.clear()
+        if not os.path.isdir(self.config_dir):
+            return
+        deleted_dir = '%s%s%s' % (self.config_dir, DELETED_DIR_MARKER,
+                                  uuidutils.generate_uuid())
+        try:
+            os.rename(self.config_dir, deleted_dir)
+        except OSError:
+            LOG.warning(_("Unable to move config dir %s aside, removing "
+                          "it in place"), self.config_dir)
+            _remove_dir(self.config_dir)
+            return
+        eventlet.spawn_n(_remove_dir, deleted_dir)
 
     def _get_config_filename(self, kind):
         config_dir = self.etc_dir
         return os.path.join(config_dir, kind)
 
     def _ensure_dir(self, dir_path):
-        if not os.path.isdir(dir_path):
+        try:
             os.makedirs(dir_path, 0o755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
     def ensure_config_dir(self, vpnservice):
         """Create config directory if it does not exist."""
-        self._ensure_dir(self.config_dir)
-        for subdir in self.CONFIG_DIRS:
-            dir_path = os.path.join(self.config_dir, subdir)
+        for dir_path in self.config_subdirs:
             self._ensure_dir(dir_path)
 
     def _gen_config_content(self, template_file, vpnservice):
@@ -196,6 +276,10 @@ class BaseSwanProcess():
     def get_status(self):
         pass
 
+    def _may_be_running(self):
+        """Cheap check, without running commands, for a stopped process."""
+        return True
+
     @property
     def status(self):
         if self.active:
@@ -205,7 +289,7 @@ class BaseSwanProcess():
     @property
     def active(self):
         """Check if the process is active or not."""
-        if not self.namespace:
+        if not self.namespace or not self._may_be_running():
             return False
         try:
             status = self.get_status()
@@ -271,19 +355,14 @@ class BaseSwanProcess():
         """Stop process."""
 
     def _update_connection_status(self, status_output):
-        for line in status_output.split('\n'):
-            m = re.search('\d\d\d "([a-f0-9\-]+).* (unrouted|erouted);', line)
-            if not m:
-                continue
-            connection_id = m.group(1)
-            status = m.group(2)
-            if not self.connection_status.get(connection_id):
-                self.connection_status[connection_id] = {
-                    'status': None,
-                    'updated_pending_status': False
-                }
-            self.connection_status[
-                connection_id]['status'] = STATUS_MAP[status]
+        # If a connection is listed more than once, the last entry wins
+        statuses = dict(m.group('id', 'status')
+                        for m in _STATUS_RE.finditer(status_output))
+        for connection_id, status in statuses.items():
+            connection_status = self.connection_status.setdefault(
+                connection_id, {'status': None,
+                                'updated_pending_status': False})
+            connection_status['status'] = STATUS_MAP[status]
 
 
 class OpenSwanProcess(BaseSwanProcess):
@@ -305,11 +384,15 @@ class OpenSwanProcess(BaseSwanProcess):
             self.etc_dir, 'ipsec.conf')
         self.pid_path = os.path.join(
             self.config_dir, 'var', 'run', 'pluto')
+        self._ip_wrapper = None
 
     def _execute(self, cmd, check_exit_code=True):
         """Execute command on namespace."""
-        ip_wrapper = ip_lib.IPWrapper(self.root_helper, self.namespace)
-        return ip_wrapper.netns.execute(
+        if (not self._ip_wrapper or
+                self._ip_wrapper.namespace != self.namespace):
+            self._ip_wrapper = ip_lib.IPWrapper(self.root_helper,
+                                                self.namespace)
+        return self._ip_wrapper.netns.execute(
             cmd,
             check_exit_code=check_exit_code)
 
@@ -329,6 +412,11 @@ class OpenSwanProcess(BaseSwanProcess):
             self.conf.openswan.ipsec_secret_template,
             self.vpnservice)
 
+    def _may_be_running(self):
+        # pluto creates its control socket when started. Without it, whack
+        # cannot succeed, so don't spend a command in the namespace on it.
+        return os.path.exists('%s.ctl' % self.pid_path)
+
     def get_status(self):
         return self._execute([self.binary,
                               'whack',
@@ -345,8 +433,9 @@ class OpenSwanProcess(BaseSwanProcess):
     def _get_nexthop(self, address):
         routes = self._execute(
             ['ip', 'route', 'get', address])
-        if routes.find('via') >= 0:
-            return routes.split(' ')[2]
+        m = _NEXTHOP_RE.search(routes)
+        if m:
+            return m.group(1)
         return address
 
     def _virtual_privates(self):
@@ -355,14 +444,14 @@ class OpenSwanProcess(BaseSwanProcess):
         virtual_private contains the networks
         that are allowed as subnet for the remote client.
         """
-        virtual_privates = []
-        nets = [self.vpnservice['subnet']['cidr']]
-        for ipsec_site_conn in self.vpnservice['ipsec_site_connections']:
-            nets += ipsec_site_conn['peer_cidrs']
-        for net in nets:
-            version = netaddr.IPNetwork(net).version
-            virtual_privates.append('%%v%s:%s' % (version, net))
-        return ','.join(virtual_privates)
+        peer_cidrs = itertools.chain.from_iterable(
+            ipsec_site_conn['peer_cidrs']
+            for ipsec_site_conn in self.vpnservice['ipsec_site_connections'])
+        nets = itertools.chain([self.vpnservice['subnet']['cidr']],
+                               peer_cidrs)
+        # Only IPv6 CIDRs contain ':', no need to fully parse them
+        return ','.join('%%v%d:%s' % (6 if ':' in net else 4, net)
+                        for net in nets)
 
     def start(self):
         """Start the process.
@@ -385,8 +474,13 @@ class OpenSwanProcess(BaseSwanProcess):
                        '--virtual_private', virtual_private
                        ])
         #add connections
-        for ipsec_site_conn in self.vpnservice['ipsec_site_connections']:
-            nexthop = self._get_nexthop(ipsec_site_conn['peer_address'])
+        ipsec_site_conns = self.vpnservice['ipsec_site_connections']
+        # Route lookups are independent, so run them concurrently
+        pool = eventlet.GreenPool(size=MAX_CONCURRENT_COMMANDS)
+        nexthops = list(pool.imap(self._get_nexthop,
+                                  [ipsec_site_conn['peer_address']
+                                   for ipsec_site_conn in ipsec_site_conns]))
+        for ipsec_site_conn, nexthop in zip(ipsec_site_conns, nexthops):
             self._execute([self.binary,
                            'addconn',
                            '--ctlbase', '%s.ctl' % self.pid_path,
@@ -415,18 +509,24 @@ class OpenSwanProcess(BaseSwanProcess):
                            '--initiate'
                            ])
 
+    def _terminate_connection(self, conn_id):
+        return self._execute([self.binary,
+                              'whack',
+                              '--ctlbase', self.pid_path,
+                              '--name', '%s/0x1' % conn_id,
+                              '--terminate'
+                              ])
+
     def disconnect(self):
         if not self.namespace:
             return
         if not self.vpnservice:
             return
-        for conn_id in self.connection_status:
-            self._execute([self.binary,
-                           'whack',
-                           '--ctlbase', self.pid_path,
-                           '--name', '%s/0x1' % conn_id,
-                           '--terminate'
-                           ])
+        # Terminate requests are independent, so issue them concurrently
+        # instead of waiting on each whack in turn.
+        pool = eventlet.GreenPool(size=MAX_CONCURRENT_COMMANDS)
+        list(pool.imap(self._terminate_connection,
+                       list(self.connection_status)))
 
     def stop(self):
         #Stop process using whack
@@ -501,15 +601,19 @@ class IPsecDriver(device_drivers.DeviceDriver):
 
         self.processes = {}
         self.process_status_cache = {}
+        self._sync_routers = []
+        self._sync_requested = False
+        self._sync_running = False
+        remove_deleted_config_dirs()
 
         self.endpoints = [self]
         self.conn.create_consumer(node_topic, self.endpoints, fanout=False)
         self.conn.consume_in_threads()
         self.agent_rpc = IPsecVpnDriverApi(topics.IPSEC_DRIVER_TOPIC, '1.0')
-        self.process_status_cache_check = loopingcall.FixedIntervalLoopingCall(
-            self.report_status, self.context)
-        self.process_status_cache_check.start(
-            interval=self.conf.ipsec.ipsec_status_check_interval)
+        self.report_interval = self.conf.ipsec.ipsec_status_check_interval
+        self._report_wakeup = eventlet.event.Event()
+        self._report_thread = eventlet.spawn(self._report_status_loop,
+                                             self.context)
 
     def _update_nat(self, vpnservice, func):
         """Setting up nat rule in iptables.
@@ -539,6 +643,10 @@ class IPsecDriver(device_drivers.DeviceDriver):
         Then this method start sync with server.
         """
         self.sync(context, [])
+        self.report_interval = self.conf.ipsec.ipsec_status_check_interval
+        # Cut short the current wait, which may be a backed off one
+        if not self._report_wakeup.ready():
+            self._report_wakeup.send()
 
     @abc.abstractmethod
     def create_process(self, process_id, vpnservice, namespace):
@@ -590,13 +698,14 @@ class IPsecDriver(device_drivers.DeviceDriver):
             del self.processes[process_id]
 
     def get_process_status_cache(self, process):
-        if not self.process_status_cache.get(process.id):
-            self.process_status_cache[process.id] = {
+        status_cache = self.process_status_cache.get(process.id)
+        if status_cache is None:
+            status_cache = self.process_status_cache[process.id] = {
                 'status': None,
                 'id': process.vpnservice['id'],
                 'updated_pending_status': False,
                 'ipsec_site_connections': {}}
-        return self.process_status_cache[process.id]
+        return status_cache
 
     def is_status_updated(self, process, previous_status):
         if process.updated_pending_status:
@@ -609,15 +718,20 @@ class IPsecDriver(device_drivers.DeviceDriver):
 
     def unset_updated_pending_status(self, process):
         process.updated_pending_status = False
-        for connection_status in process.connection_status.values():
+        for connection_status in six.itervalues(process.connection_status):
             connection_status['updated_pending_status'] = False
 
     def copy_process_status(self, process):
+        # Connection statuses only hold scalars, so copying each of them
+        # is enough to detach the result from the process.
+        connection_status = dict(
+            (conn_id, conn_status.copy())
+            for conn_id, conn_status in process.connection_status.items())
         return {
             'id': process.vpnservice['id'],
             'status': process.status,
             'updated_pending_status': process.updated_pending_status,
-            'ipsec_site_connections': copy.deepcopy(process.connection_status)
+            'ipsec_site_connections': connection_status
         }
 
     def update_downed_connections(self, process_id, new_status):
@@ -636,6 +750,54 @@ class IPsecDriver(device_drivers.DeviceDriver):
                         'updated_pending_status': True
                     }
 
+    def _periodic_report_status(self, context):
+        """Report status and return the delay until the next check.
+
+        While nothing changes, the delay is doubled up to
+        ipsec_status_check_max_interval. It goes back to
+        ipsec_status_check_interval once a change is reported.
+        """
+        min_interval = self.conf.ipsec.ipsec_status_check_interval
+        if self.report_status(context):
+            self.report_interval = min_interval
+        else:
+            max_interval = max(
+                min_interval,
+                self.conf.ipsec.ipsec_status_check_max_interval)
+            self.report_interval = min(self.report_interval * 2,
+                                       max_interval)
+        return self.report_interval
+
+    def stop_report_status(self):
+        """Stop periodic status reporting."""
+        self._report_thread.kill()
+
+    def _wait_for_report(self, interval):
+        """Wait up to interval seconds, return True if woken up early."""
+        with eventlet.Timeout(interval, False):
+            self._report_wakeup.wait()
+            self._report_wakeup = eventlet.event.Event()
+            return True
+        return False
+
+    def _report_status_loop(self, context):
+        """Report status periodically, until reporting fails.
+
+        Waits for the delay returned by _periodic_report_status(). When
+        woken up early by vpnservice_updated(), whose sync has already
+        reported status, the wait is restarted with the reset interval
+        instead of checking status again.
+        """
+        try:
+            interval = self._periodic_report_status(context)
+            while True:
+                if self._wait_for_report(interval):
+                    interval = self.report_interval
+                else:
+                    interval = self._periodic_report_status(context)
+        except Exception:
+            LOG.exception(_("Failed to report ipsec status"))
+
     def report_status(self, context):
         status_changed_vpn_services = []
         for process in self.processes.values():
@@ -654,8 +816,8 @@ class IPsecDriver(device_drivers.DeviceDriver):
             self.agent_rpc.update_status(
                 context,
                 status_changed_vpn_services)
+        return status_changed_vpn_services
 
-    @lockutils.synchronized('vpn-agent', 'neutron-')
     def sync(self, context, routers):
         """Sync status with server side.
 
@@ -671,7 +833,40 @@ class IPsecDriver(device_drivers.DeviceDriver):
 
         In order to handle, these failure cases,
         This driver takes simple sync strategies.
+
+        Only one sync runs at a time. Instead of waiting on a lock, a
+        request made while a sync is running is queued, and the running
+        sync does one more pass covering all queued requests. All passes
+        use the context of the caller running the sync.
+
+        If a pass fails while another request is queued, its routers are
+        carried over to the next pass, and the first failure is raised
+        once the queued passes have run.
         """
+        self._sync_routers.extend(routers)
+        self._sync_requested = True
+        if self._sync_running:
+            return
+        self._sync_running = True
+        exc_info = None
+        try:
+            while self._sync_requested:
+                self._sync_requested = False
+                routers, self._sync_routers = self._sync_routers, []
+                try:
+                    self._sync(context, routers)
+                except Exception:
+                    exc_info = exc_info or sys.exc_info()
+                    if self._sync_requested:
+                        LOG.exception(_("Failed to sync ipsec processes, "
+                                        "retrying with queued requests"))
+                        self._sync_routers[:0] = routers
+        finally:
+            self._sync_running = False
+        if exc_info:
+            six.reraise(*exc_info)
+
+    def _sync(self, context, routers):
         vpnservices = self.agent_rpc.get_vpn_services_on_host(
             context, self.host)
         router_ids = [vpnservice['router_id'] for vpnservice in vpnservices]
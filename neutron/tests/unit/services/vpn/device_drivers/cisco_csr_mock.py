@@ -32,6 +32,14 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+_LOCALHOST = re.compile(r'localhost')
+
+# Canned responses, shared by the handlers. Not to be modified.
+_UNAUTHORIZED = {'status_code': requests.codes.UNAUTHORIZED}
+_NO_CONTENT = {'status_code': requests.codes.NO_CONTENT}
+_NOT_FOUND = {'status_code': requests.codes.NOT_FOUND}
+_BAD_REQUEST = {'status_code': requests.codes.BAD_REQUEST}
+
 
 def repeat(n):
     """Decorator to limit the number of times a handler is called.
@@ -41,15 +49,15 @@ def repeat(n):
     allowing other handlers, if any, to be invoked.
     """
 
-    class static:
-        retries = n
+    # Single element list, so the count can be updated from the closure
+    retries = [n]
 
     def decorator(func):
         @functools.wraps(func)
         def wrapped(*args, **kwargs):
-            if static.retries == 0:
+            if retries[0] == 0:
                 return None
-            static.retries -= 1
+            retries[0] -= 1
             return func(*args, **kwargs)
         return wrapped
     return decorator
@@ -63,15 +71,13 @@ def filter_request(methods, resource):
     return None, allowing other handlers, if any, to be invoked.
     """
 
-    class static:
-        target_methods = [m.upper() for m in methods]
-        target_resource = resource
+    target_methods = frozenset(m.upper() for m in methods)
 
     def decorator(func):
         @functools.wraps(func)
         def wrapped(*args, **kwargs):
-            if (args[1].method in static.target_methods and
-                static.target_resource in args[0].path):
+            if (args[1].method in target_methods and
+                resource in args[0].path):
                 return func(*args, **kwargs)
             else:
                 return None  # Not for this resource
@@ -79,17 +85,17 @@ def filter_request(methods, resource):
     return decorator
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def token(url, request):
     if 'auth/token-services' in url.path:
         return {'status_code': requests.codes.OK,
                 'content': {'token-id': 'dummy-token'}}
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def token_unauthorized(url, request):
     if 'auth/token-services' in url.path:
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
 
 
 @httmock.urlmatch(netloc=r'wrong-host')
@@ -108,19 +114,19 @@ def timeout(url, request):
     """Simulated timeout of a normal request."""
 
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     raise r_exc.Timeout()
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def no_such_resource(url, request):
     """Indicate not found error, when invalid resource requested."""
-    return {'status_code': requests.codes.NOT_FOUND}
+    return _NOT_FOUND
 
 
 @filter_request(['get'], 'global/host-name')
 @repeat(1)
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def expired_request(url, request):
     """Simulate access denied failure on first request for this resource.
 
@@ -133,119 +139,167 @@ def expired_request(url, request):
     different resource (e.g. 'global/local-users')
     """
 
-    return {'status_code': requests.codes.UNAUTHORIZED}
+    return _UNAUTHORIZED
+
+
+def _check_auth(request):
+    """Return an unauthorized response, if the request has no token."""
+    if not request.headers.get('X-auth-token', None):
+        return _UNAUTHORIZED
+
+
+def _dispatch(routes, url, request):
+    """Invoke the handler for the first route that matches the URL path."""
+    for pattern, handler in routes:
+        if pattern.search(url.path):
+            return handler(url, request)
+
+
+def _get_host_name(url, request):
+    content = {u'kind': u'object#host-name',
+               u'host-name': u'Router'}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_local_users(url, request):
+    content = {u'kind': u'collection#local-user',
+               u'users': ['peter', 'paul', 'mary']}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_interface(url, request):
+    actual_interface = url.path.split('/')[-1]
+    ip = actual_interface[-1]
+    content = {u'kind': u'object#interface',
+               u'description': u'Changed description',
+               u'if-name': actual_interface,
+               u'proxy-arp': True,
+               u'subnet-mask': u'255.255.255.0',
+               u'icmp-unreachable': True,
+               u'nat-direction': u'',
+               u'icmp-redirects': True,
+               u'ip-address': u'192.168.200.%s' % ip,
+               u'verify-unicast-source': False,
+               u'type': u'ethernet'}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_ike_policy(url, request):
+    content = {u'kind': u'object#ike-policy',
+               u'priority-id': u'2',
+               u'version': u'v1',
+               u'local-auth-method': u'pre-share',
+               u'encryption': u'aes256',
+               u'hash': u'sha',
+               u'dhGroup': 5,
+               u'lifetime': 3600}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_keyring(url, request):
+    content = {u'kind': u'object#ike-keyring',
+               u'keyring-name': u'5',
+               u'pre-shared-key-list': [
+                   {u'key': u'super-secret',
+                    u'encrypted': False,
+                    u'peer-address': u'10.10.10.20 255.255.255.0'}
+               ]}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_ipsec_policy(url, request):
+    ipsec_policy_id = url.path.split('/')[-1]
+    content = {u'kind': u'object#ipsec-policy',
+               u'mode': u'tunnel',
+               u'policy-id': u'%s' % ipsec_policy_id,
+               u'protection-suite': {
+                   u'esp-encryption': u'esp-256-aes',
+                   u'esp-authentication': u'esp-sha-hmac',
+                   u'ah': u'ah-sha-hmac',
+               },
+               u'anti-replay-window-size': u'Disable',
+               u'lifetime-sec': 120,
+               u'pfs': u'group5',
+               u'lifetime-kb': 4608000,
+               u'idle-time': None}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_site_to_site(url, request):
+    tunnel = url.path.split('/')[-1]
+    # Use same number, to allow mock to generate IPSec policy ID
+    ipsec_policy_id = tunnel[6:]
+    content = {u'kind': u'object#vpn-site-to-site',
+               u'vpn-interface-name': u'%s' % tunnel,
+               u'ip-version': u'ipv4',
+               u'vpn-type': u'site-to-site',
+               u'ipsec-policy-id': u'%s' % ipsec_policy_id,
+               u'ike-profile-id': None,
+               u'mtu': 1500,
+               u'local-device': {
+                   u'ip-address': '10.3.0.1/24',
+                   u'tunnel-ip-address': '10.10.10.10'
+               },
+               u'remote-device': {
+                   u'tunnel-ip-address': '10.10.10.20'
+               }}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_keepalive(url, request):
+    content = {u'interval': 60,
+               u'retry': 4,
+               u'periodic': True}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_static_route(url, request):
+    content = {u'destination-network': u'10.1.0.0/24',
+               u'kind': u'object#static-route',
+               u'next-hop-router': None,
+               u'outgoing-interface': u'GigabitEthernet1',
+               u'admin-distance': 1}
+    return httmock.response(requests.codes.OK, content=content)
 
 
-@httmock.urlmatch(netloc=r'localhost')
+def _get_active_sessions(url, request):
+    # Only including needed fields for mock
+    content = {u'kind': u'collection#vpn-active-sessions',
+               u'items': [{u'status': u'DOWN-NEGOTIATING',
+                           u'vpn-interface-name': u'Tunnel123'}, ]}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+# Checked in order, first match wins
+_GET_ROUTES = [
+    (re.compile(r'global/host-name'), _get_host_name),
+    (re.compile(r'global/local-users'), _get_local_users),
+    (re.compile(r'interfaces/GigabitEthernet'), _get_interface),
+    (re.compile(r'vpn-svc/ike/policies/2'), _get_ike_policy),
+    (re.compile(r'vpn-svc/ike/keyrings'), _get_keyring),
+    (re.compile(r'vpn-svc/ipsec/policies/'), _get_ipsec_policy),
+    (re.compile(r'vpn-svc/site-to-site/Tunnel'), _get_site_to_site),
+    (re.compile(r'vpn-svc/ike/keepalive'), _get_keepalive),
+    (re.compile(r'routing-svc/static-routes'), _get_static_route),
+    (re.compile(r'vpn-svc/site-to-site/active/sessions'),
+     _get_active_sessions),
+]
+
+
+@httmock.urlmatch(netloc=_LOCALHOST)
 def normal_get(url, request):
     if request.method != 'GET':
         return
     LOG.debug("GET mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    if 'global/host-name' in url.path:
-        content = {u'kind': u'object#host-name',
-                   u'host-name': u'Router'}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'global/local-users' in url.path:
-        content = {u'kind': u'collection#local-user',
-                   u'users': ['peter', 'paul', 'mary']}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'interfaces/GigabitEthernet' in url.path:
-        actual_interface = url.path.split('/')[-1]
-        ip = actual_interface[-1]
-        content = {u'kind': u'object#interface',
-                   u'description': u'Changed description',
-                   u'if-name': actual_interface,
-                   u'proxy-arp': True,
-                   u'subnet-mask': u'255.255.255.0',
-                   u'icmp-unreachable': True,
-                   u'nat-direction': u'',
-                   u'icmp-redirects': True,
-                   u'ip-address': u'192.168.200.%s' % ip,
-                   u'verify-unicast-source': False,
-                   u'type': u'ethernet'}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/ike/policies/2' in url.path:
-        content = {u'kind': u'object#ike-policy',
-                   u'priority-id': u'2',
-                   u'version': u'v1',
-                   u'local-auth-method': u'pre-share',
-                   u'encryption': u'aes256',
-                   u'hash': u'sha',
-                   u'dhGroup': 5,
-                   u'lifetime': 3600}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/ike/keyrings' in url.path:
-        content = {u'kind': u'object#ike-keyring',
-                   u'keyring-name': u'5',
-                   u'pre-shared-key-list': [
-                       {u'key': u'super-secret',
-                        u'encrypted': False,
-                        u'peer-address': u'10.10.10.20 255.255.255.0'}
-                   ]}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/ipsec/policies/' in url.path:
-        ipsec_policy_id = url.path.split('/')[-1]
-        content = {u'kind': u'object#ipsec-policy',
-                   u'mode': u'tunnel',
-                   u'policy-id': u'%s' % ipsec_policy_id,
-                   u'protection-suite': {
-                       u'esp-encryption': u'esp-256-aes',
-                       u'esp-authentication': u'esp-sha-hmac',
-                       u'ah': u'ah-sha-hmac',
-                   },
-                   u'anti-replay-window-size': u'Disable',
-                   u'lifetime-sec': 120,
-                   u'pfs': u'group5',
-                   u'lifetime-kb': 4608000,
-                   u'idle-time': None}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/site-to-site/Tunnel' in url.path:
-        tunnel = url.path.split('/')[-1]
-        # Use same number, to allow mock to generate IPSec policy ID
-        ipsec_policy_id = tunnel[6:]
-        content = {u'kind': u'object#vpn-site-to-site',
-                   u'vpn-interface-name': u'%s' % tunnel,
-                   u'ip-version': u'ipv4',
-                   u'vpn-type': u'site-to-site',
-                   u'ipsec-policy-id': u'%s' % ipsec_policy_id,
-                   u'ike-profile-id': None,
-                   u'mtu': 1500,
-                   u'local-device': {
-                       u'ip-address': '10.3.0.1/24',
-                       u'tunnel-ip-address': '10.10.10.10'
-                   },
-                   u'remote-device': {
-                       u'tunnel-ip-address': '10.10.10.20'
-                   }}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/ike/keepalive' in url.path:
-        content = {u'interval': 60,
-                   u'retry': 4,
-                   u'periodic': True}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'routing-svc/static-routes' in url.path:
-        content = {u'destination-network': u'10.1.0.0/24',
-                   u'kind': u'object#static-route',
-                   u'next-hop-router': None,
-                   u'outgoing-interface': u'GigabitEthernet1',
-                   u'admin-distance': 1}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/site-to-site/active/sessions' in url.path:
-        # Only including needed fields for mock
-        content = {u'kind': u'collection#vpn-active-sessions',
-                   u'items': [{u'status': u'DOWN-NEGOTIATING',
-                               u'vpn-interface-name': u'Tunnel123'}, ]}
-        return httmock.response(requests.codes.OK, content=content)
+    return _check_auth(request) or _dispatch(_GET_ROUTES, url, request)
 
 
 @filter_request(['get'], 'vpn-svc/ike/keyrings')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_fqdn(url, request):
     LOG.debug("GET FQDN mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     content = {u'kind': u'object#ike-keyring',
                u'keyring-name': u'5',
                u'pre-shared-key-list': [
@@ -257,11 +311,11 @@ def get_fqdn(url, request):
 
 
 @filter_request(['get'], 'vpn-svc/ipsec/policies/')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_no_ah(url, request):
     LOG.debug("GET No AH mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     ipsec_policy_id = url.path.split('/')[-1]
     content = {u'kind': u'object#ipsec-policy',
                u'mode': u'tunnel',
@@ -278,42 +332,52 @@ def get_no_ah(url, request):
     return httmock.response(requests.codes.OK, content=content)
 
 
-@httmock.urlmatch(netloc=r'localhost')
+def _get_default_ike_policy(url, request):
+    content = {u'kind': u'object#ike-policy',
+               u'priority-id': u'2',
+               u'version': u'v1',
+               u'local-auth-method': u'pre-share',
+               u'encryption': u'des',
+               u'hash': u'sha',
+               u'dhGroup': 1,
+               u'lifetime': 86400}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+def _get_default_ipsec_policy(url, request):
+    ipsec_policy_id = url.path.split('/')[-1]
+    content = {u'kind': u'object#ipsec-policy',
+               u'mode': u'tunnel',
+               u'policy-id': u'%s' % ipsec_policy_id,
+               u'protection-suite': {},
+               u'lifetime-sec': 3600,
+               u'pfs': u'Disable',
+               u'anti-replay-window-size': u'None',
+               u'lifetime-kb': 4608000,
+               u'idle-time': None}
+    return httmock.response(requests.codes.OK, content=content)
+
+
+_GET_DEFAULTS_ROUTES = [
+    (re.compile(r'vpn-svc/ike/policies/2'), _get_default_ike_policy),
+    (re.compile(r'vpn-svc/ipsec/policies/'), _get_default_ipsec_policy),
+]
+
+
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_defaults(url, request):
     if request.method != 'GET':
         return
     LOG.debug("GET mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    if 'vpn-svc/ike/policies/2' in url.path:
-        content = {u'kind': u'object#ike-policy',
-                   u'priority-id': u'2',
-                   u'version': u'v1',
-                   u'local-auth-method': u'pre-share',
-                   u'encryption': u'des',
-                   u'hash': u'sha',
-                   u'dhGroup': 1,
-                   u'lifetime': 86400}
-        return httmock.response(requests.codes.OK, content=content)
-    if 'vpn-svc/ipsec/policies/' in url.path:
-        ipsec_policy_id = url.path.split('/')[-1]
-        content = {u'kind': u'object#ipsec-policy',
-                   u'mode': u'tunnel',
-                   u'policy-id': u'%s' % ipsec_policy_id,
-                   u'protection-suite': {},
-                   u'lifetime-sec': 3600,
-                   u'pfs': u'Disable',
-                   u'anti-replay-window-size': u'None',
-                   u'lifetime-kb': 4608000,
-                   u'idle-time': None}
-        return httmock.response(requests.codes.OK, content=content)
+    return (_check_auth(request) or
+            _dispatch(_GET_DEFAULTS_ROUTES, url, request))
 
 
 @filter_request(['get'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_unnumbered(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     tunnel = url.path.split('/')[-1]
     ipsec_policy_id = tunnel[6:]
     content = {u'kind': u'object#vpn-site-to-site',
@@ -334,10 +398,10 @@ def get_unnumbered(url, request):
 
 
 @filter_request(['get'], 'vpn-svc/site-to-site/Tunnel')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_admin_down(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     # URI has .../Tunnel#/state, so get number from 2nd to last element
     tunnel = url.path.split('/')[-2]
     content = {u'kind': u'object#vpn-site-to-site-state',
@@ -348,10 +412,10 @@ def get_admin_down(url, request):
 
 
 @filter_request(['get'], 'vpn-svc/site-to-site/Tunnel')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_admin_up(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     # URI has .../Tunnel#/state, so get number from 2nd to last element
     tunnel = url.path.split('/')[-2]
     content = {u'kind': u'object#vpn-site-to-site-state',
@@ -362,10 +426,10 @@ def get_admin_up(url, request):
 
 
 @filter_request(['get'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_mtu(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     tunnel = url.path.split('/')[-1]
     ipsec_policy_id = tunnel[6:]
     content = {u'kind': u'object#vpn-site-to-site',
@@ -386,91 +450,116 @@ def get_mtu(url, request):
 
 
 @filter_request(['get'], 'vpn-svc/ike/keepalive')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_not_configured(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.NOT_FOUND}
+        return _UNAUTHORIZED
+    return _NOT_FOUND
 
 
 @filter_request(['get'], 'vpn-svc/site-to-site/active/sessions')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_none(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     content = {u'kind': u'collection#vpn-active-sessions',
                u'items': []}
     return httmock.response(requests.codes.OK, content=content)
 
 
 @filter_request(['get'], 'interfaces/GigabitEthernet3')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def get_local_ip(url, request):
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     content = {u'kind': u'object#interface',
                u'subnet-mask': u'255.255.255.0',
                u'ip-address': u'10.5.0.2'}
     return httmock.response(requests.codes.OK, content=content)
 
 
-@httmock.urlmatch(netloc=r'localhost')
+def _post_interface(url, request):
+    return _NO_CONTENT
+
+
+def _post_local_user(url, request):
+    if 'username' not in request.body:
+        return _BAD_REQUEST
+    if '"privilege": 20' in request.body:
+        return _BAD_REQUEST
+    headers = {'location': '%s/test-user' % url.geturl()}
+    return httmock.response(requests.codes.CREATED, headers=headers)
+
+
+def _post_ike_policy(url, request):
+    headers = {'location': "%s/2" % url.geturl()}
+    return httmock.response(requests.codes.CREATED, headers=headers)
+
+
+def _post_ipsec_policy(url, request):
+    m = re.search(r'"policy-id": "(\S+)"', request.body)
+    if m:
+        headers = {'location': "%s/%s" % (url.geturl(), m.group(1))}
+        return httmock.response(requests.codes.CREATED, headers=headers)
+    return _BAD_REQUEST
+
+
+def _post_keyring(url, request):
+    headers = {'location': "%s/5" % url.geturl()}
+    return httmock.response(requests.codes.CREATED, headers=headers)
+
+
+def _post_site_to_site(url, request):
+    m = re.search(r'"vpn-interface-name": "(\S+)"', request.body)
+    if m:
+        headers = {'location': "%s/%s" % (url.geturl(), m.group(1))}
+        return httmock.response(requests.codes.CREATED, headers=headers)
+    return _BAD_REQUEST
+
+
+def _post_static_route(url, request):
+    headers = {'location':
+               "%s/10.1.0.0_24_GigabitEthernet1" % url.geturl()}
+    return httmock.response(requests.codes.CREATED, headers=headers)
+
+
+# Checked in order, first match wins
+_POST_ROUTES = [
+    (re.compile(r'interfaces/GigabitEthernet'), _post_interface),
+    (re.compile(r'global/local-users'), _post_local_user),
+    (re.compile(r'vpn-svc/ike/policies'), _post_ike_policy),
+    (re.compile(r'vpn-svc/ipsec/policies'), _post_ipsec_policy),
+    (re.compile(r'vpn-svc/ike/keyrings'), _post_keyring),
+    (re.compile(r'vpn-svc/site-to-site'), _post_site_to_site),
+    (re.compile(r'routing-svc/static-routes'), _post_static_route),
+]
+
+
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post(url, request):
     if request.method != 'POST':
         return
     LOG.debug("POST mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    if 'interfaces/GigabitEthernet' in url.path:
-        return {'status_code': requests.codes.NO_CONTENT}
-    if 'global/local-users' in url.path:
-        if 'username' not in request.body:
-            return {'status_code': requests.codes.BAD_REQUEST}
-        if '"privilege": 20' in request.body:
-            return {'status_code': requests.codes.BAD_REQUEST}
-        headers = {'location': '%s/test-user' % url.geturl()}
-        return httmock.response(requests.codes.CREATED, headers=headers)
-    if 'vpn-svc/ike/policies' in url.path:
-        headers = {'location': "%s/2" % url.geturl()}
-        return httmock.response(requests.codes.CREATED, headers=headers)
-    if 'vpn-svc/ipsec/policies' in url.path:
-        m = re.search(r'"policy-id": "(\S+)"', request.body)
-        if m:
-            headers = {'location': "%s/%s" % (url.geturl(), m.group(1))}
-            return httmock.response(requests.codes.CREATED, headers=headers)
-        return {'status_code': requests.codes.BAD_REQUEST}
-    if 'vpn-svc/ike/keyrings' in url.path:
-        headers = {'location': "%s/5" % url.geturl()}
-        return httmock.response(requests.codes.CREATED, headers=headers)
-    if 'vpn-svc/site-to-site' in url.path:
-        m = re.search(r'"vpn-interface-name": "(\S+)"', request.body)
-        if m:
-            headers = {'location': "%s/%s" % (url.geturl(), m.group(1))}
-            return httmock.response(requests.codes.CREATED, headers=headers)
-        return {'status_code': requests.codes.BAD_REQUEST}
-    if 'routing-svc/static-routes' in url.path:
-        headers = {'location':
-                   "%s/10.1.0.0_24_GigabitEthernet1" % url.geturl()}
-        return httmock.response(requests.codes.CREATED, headers=headers)
+    return _check_auth(request) or _dispatch(_POST_ROUTES, url, request)
 
 
 @filter_request(['post'], 'global/local-users')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_change_attempt(url, request):
     LOG.debug("POST change value mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     return {'status_code': requests.codes.NOT_FOUND,
             'content': {
                 u'error-code': -1,
                 u'error-message': u'user test-user already exists'}}
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_duplicate(url, request):
     LOG.debug("POST duplicate mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
+        return _UNAUTHORIZED
     return {'status_code': requests.codes.BAD_REQUEST,
             'content': {
                 u'error-code': -1,
@@ -479,101 +568,95 @@ def post_duplicate(url, request):
 
 
 @filter_request(['post'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_missing_ipsec_policy(url, request):
     LOG.debug("POST missing ipsec policy mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
 @filter_request(['post'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_missing_ike_policy(url, request):
     LOG.debug("POST missing ike policy mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
 @filter_request(['post'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_bad_ip(url, request):
     LOG.debug("POST bad IP mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
 @filter_request(['post'], 'vpn-svc/site-to-site')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_bad_mtu(url, request):
     LOG.debug("POST bad mtu mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
 @filter_request(['post'], 'vpn-svc/ipsec/policies')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_bad_lifetime(url, request):
     LOG.debug("POST bad lifetime mock for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
 @filter_request(['post'], 'vpn-svc/ipsec/policies')
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def post_bad_name(url, request):
     LOG.debug("POST bad IPSec policy name for %s", url)
     if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
-    return {'status_code': requests.codes.BAD_REQUEST}
+        return _UNAUTHORIZED
+    return _BAD_REQUEST
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def put(url, request):
     if request.method != 'PUT':
         return
     LOG.debug("PUT mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
     # Any resource
-    return {'status_code': requests.codes.NO_CONTENT}
+    return _check_auth(request) or _NO_CONTENT
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def delete(url, request):
     if request.method != 'DELETE':
         return
     LOG.debug("DELETE mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
     # Any resource
-    return {'status_code': requests.codes.NO_CONTENT}
+    return _check_auth(request) or _NO_CONTENT
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def delete_unknown(url, request):
     if request.method != 'DELETE':
         return
     LOG.debug("DELETE unknown mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
     # Any resource
-    return {'status_code': requests.codes.NOT_FOUND,
-            'content': {
-                u'error-code': -1,
-                u'error-message': 'user unknown not found'}}
+    return _check_auth(request) or {
+        'status_code': requests.codes.NOT_FOUND,
+        'content': {
+            u'error-code': -1,
+            u'error-message': 'user unknown not found'}}
 
 
-@httmock.urlmatch(netloc=r'localhost')
+@httmock.urlmatch(netloc=_LOCALHOST)
 def delete_not_allowed(url, request):
     if request.method != 'DELETE':
         return
     LOG.debug("DELETE not allowed mock for %s", url)
-    if not request.headers.get('X-auth-token', None):
-        return {'status_code': requests.codes.UNAUTHORIZED}
     # Any resource
-    return {'status_code': requests.codes.METHOD_NOT_ALLOWED}
+    return (_check_auth(request) or
+            {'status_code': requests.codes.METHOD_NOT_ALLOWED})
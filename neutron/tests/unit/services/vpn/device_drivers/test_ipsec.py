@@ -13,6 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 import copy
+import errno
+import os
+
+import eventlet
+import fixtures
 import mock
 
 from neutron.openstack.common import uuidutils
@@ -52,11 +57,13 @@ class TestIPsecDeviceDriver(base.BaseTestCase):
         ]:
             mock.patch(klass).start()
         self.execute = mock.patch(
-            'neutron.agent.linux.utils.execute').start()
+            'neutron.agent.linux.utils.execute', return_value='').start()
         self.agent = mock.Mock()
         self.driver = driver(
             self.agent,
             FAKE_HOST)
+        # Tests drive status reporting themselves
+        self.driver.stop_report_status()
         self.driver.agent_rpc = mock.Mock()
 
     def test_vpnservice_updated(self):
@@ -65,6 +72,66 @@ class TestIPsecDeviceDriver(base.BaseTestCase):
             self.driver.vpnservice_updated(context)
             sync.assert_called_once_with(context, [])
 
+    def _set_status_check_intervals(self):
+        self.agent.conf.ipsec.ipsec_status_check_interval = 60
+        self.agent.conf.ipsec.ipsec_status_check_max_interval = 600
+        self.driver.report_interval = 60
+
+    def test_vpnservice_updated_resets_report_interval(self):
+        self._set_status_check_intervals()
+        self.driver.report_interval = 480
+        with mock.patch.object(self.driver, 'sync'):
+            self.driver.vpnservice_updated(mock.Mock())
+        self.assertEqual(60, self.driver.report_interval)
+
+    def test_vpnservice_updated_wakes_status_report(self):
+        waiter = eventlet.spawn(self.driver._wait_for_report, 600)
+        self.addCleanup(waiter.kill)
+        eventlet.sleep(0)
+        with mock.patch.object(self.driver, 'sync'):
+            self.driver.vpnservice_updated(mock.Mock())
+        self.assertTrue(waiter.wait())
+        self.assertFalse(self.driver._report_wakeup.ready())
+
+    def test_wait_for_report_timeout(self):
+        self.assertFalse(self.driver._wait_for_report(0))
+
+    def test_report_status_loop_wakeup_restarts_wait(self):
+        self._set_status_check_intervals()
+        context = mock.Mock()
+
+        def fake_wait(interval):
+            if wait.call_count == 1:
+                with mock.patch.object(self.driver, 'sync'):
+                    self.driver.vpnservice_updated(context)
+                return True
+            if wait.call_count == 2:
+                return False
+            raise RuntimeError()
+
+        with mock.patch.object(self.driver, 'report_status',
+                               return_value=[]) as report:
+            with mock.patch.object(self.driver, '_wait_for_report',
+                                   side_effect=fake_wait) as wait:
+                self.driver._report_status_loop(context)
+        self.assertEqual([mock.call(120), mock.call(60), mock.call(120)],
+                         wait.call_args_list)
+        self.assertEqual(2, report.call_count)
+
+    def test_periodic_report_status_backoff(self):
+        self._set_status_check_intervals()
+        context = mock.Mock()
+        with mock.patch.object(self.driver, 'report_status',
+                               return_value=[]):
+            self.assertEqual(
+                [120, 240, 480, 600, 600],
+                [self.driver._periodic_report_status(context)
+                 for i in range(5)])
+        with mock.patch.object(self.driver, 'report_status',
+                               return_value=[{'id': 'fake'}]):
+            self.assertEqual(
+                60, self.driver._periodic_report_status(context))
+
     def test_create_router(self):
         process_id = _uuid()
         process = mock.Mock()
@@ -132,6 +199,25 @@ class TestIPsecDeviceDriver(base.BaseTestCase):
              'updated_pending_status': True,
              'id': FAKE_VPN_SERVICE['id']}])
 
+    def test_copy_process_status(self):
+        process = mock.Mock()
+        process.vpnservice = FAKE_VPN_SERVICE
+        process.status = constants.ACTIVE
+        process.updated_pending_status = False
+        process.connection_status = {
+            '10': {'status': constants.ACTIVE,
+                   'updated_pending_status': True}}
+        status = self.driver.copy_process_status(process)
+        self.assertEqual(
+            {'id': FAKE_VPN_SERVICE['id'],
+             'status': constants.ACTIVE,
+             'updated_pending_status': False,
+             'ipsec_site_connections': process.connection_status},
+            status)
+        process.connection_status['10']['updated_pending_status'] = False
+        self.assertTrue(
+            status['ipsec_site_connections']['10']['updated_pending_status'])
+
     def fake_ensure_process(self, process_id, vpnservice=None):
         process = self.driver.processes.get(process_id)
         if not process:
@@ -170,6 +256,45 @@ class TestIPsecDeviceDriver(base.BaseTestCase):
                 updated_vpn_service)
             self.assertEqual(process.vpnservice, updated_vpn_service)
 
+    def test_sync_requested_while_running(self):
+        context = mock.Mock()
+        routers = [{'id': _uuid()}]
+
+        def fake_sync(context, routers):
+            if _sync.call_count == 1:
+                # Simulate a request arriving while the sync is running
+                self.driver.sync(context, routers_during_sync)
+
+        routers_during_sync = [{'id': _uuid()}]
+        with mock.patch.object(self.driver, '_sync',
+                               side_effect=fake_sync) as _sync:
+            self.driver.sync(context, routers)
+        _sync.assert_has_calls([mock.call(context, routers),
+                                mock.call(context, routers_during_sync)])
+        self.assertEqual(2, _sync.call_count)
+
+    def test_sync_failed_while_requested(self):
+        context = mock.Mock()
+        routers = [{'id': _uuid()}]
+        routers_during_sync = [{'id': _uuid()}]
+
+        def fake_sync(context, routers):
+            if _sync.call_count == 1:
+                self.driver.sync(context, routers_during_sync)
+                raise RuntimeError()
+
+        with mock.patch.object(self.driver, '_sync',
+                               side_effect=fake_sync) as _sync:
+            self.assertRaises(RuntimeError,
+                              self.driver.sync, context, routers)
+        _sync.assert_has_calls([
+            mock.call(context, routers),
+            mock.call(context, routers + routers_during_sync)])
+        self.assertEqual(2, _sync.call_count)
+        self.assertFalse(self.driver._sync_running)
+        self.assertFalse(self.driver._sync_requested)
+        self.assertEqual([], self.driver._sync_routers)
+
     def test_sync_removed(self):
         self.driver.agent_rpc.get_vpn_services_on_host.return_value = []
         context = mock.Mock()
@@ -254,3 +379,253 @@ class TestIPsecDeviceDriver(base.BaseTestCase):
         missing_conn = new_status['ipsec_site_connections'].get('20')
         self.assertIsNotNone(missing_conn)
         self.assertEqual(constants.DOWN, missing_conn['status'])
+
+
+class TestOpenSwanTemplates(base.BaseTestCase):
+    def setUp(self):
+        super(TestOpenSwanTemplates, self).setUp()
+        mock.patch.dict(ipsec_driver._TEMPLATE_CACHE, clear=True).start()
+
+    def test_template_is_compiled_once(self):
+        template_file = ipsec_driver.cfg.CONF.openswan.ipsec_config_template
+        first = ipsec_driver._get_template(template_file)
+        second = ipsec_driver._get_template(template_file)
+        self.assertIs(first, second)
+        self.assertIn(template_file, ipsec_driver._TEMPLATE_CACHE)
+
+    def test_template_with_non_ascii_text(self):
+        template_file = self.useFixture(fixtures.TempDir()).join('t')
+        with open(template_file, 'wb') as f:
+            f.write(u'# caf\xe9 {{ name }}'.encode('utf-8'))
+        template = ipsec_driver._get_template(template_file)
+        self.assertEqual(u'# caf\xe9 vpn', template.render(name='vpn'))
+
+
+class TestOpenSwanProcess(base.BaseTestCase):
+    def setUp(self):
+        super(TestOpenSwanProcess, self).setUp()
+        self.process = ipsec_driver.OpenSwanProcess(
+            mock.Mock(), 'sudo', FAKE_ROUTER_ID, None, 'ns-fake')
+
+    def test_update_connection_status(self):
+        status_output = (
+            '000 "%(active)s/0x1": 10.0.0.0/24===192.168.0.1...'
+            '192.168.0.2===20.0.0.0/24; erouted; eroute owner: #2\n'
+            '000 interface lo/lo ::1\n'
+            '000 "%(down)s/0x1": 10.0.0.0/24===192.168.0.1...'
+            '192.168.0.3===30.0.0.0/24; unrouted; eroute owner: #0\n'
+            % {'active': 'abc123', 'down': 'def456'})
+        self.process._update_connection_status(status_output)
+        self.assertEqual(
+            {'abc123': {'status': constants.ACTIVE,
+                        'updated_pending_status': False},
+             'def456': {'status': constants.DOWN,
+                        'updated_pending_status': False}},
+            self.process.connection_status)
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('os.rename')
+    @mock.patch('os.path.isdir', return_value=True)
+    def test_remove_config(self, isdir, rename, spawn_n):
+        self.process.remove_config()
+        deleted_dir = rename.call_args[0][1]
+        rename.assert_called_once_with(self.process.config_dir, deleted_dir)
+        self.assertTrue(deleted_dir.startswith(
+            self.process.config_dir + ipsec_driver.DELETED_DIR_MARKER))
+        spawn_n.assert_called_once_with(ipsec_driver._remove_dir,
+                                        deleted_dir)
+
+    @mock.patch('os.rename', side_effect=OSError)
+    @mock.patch('os.path.isdir', return_value=True)
+    @mock.patch('neutron.agent.linux.utils.execute')
+    def test_remove_config_rename_failed(self, execute, isdir, rename):
+        self.process.remove_config()
+        execute.assert_called_once_with(
+            ['rm', '-rf', self.process.config_dir], check_exit_code=False)
+
+    @mock.patch('os.rename')
+    @mock.patch('os.path.isdir', return_value=False)
+    def test_remove_config_no_dir(self, isdir, rename):
+        self.process.remove_config()
+        self.assertFalse(rename.called)
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('os.listdir')
+    def test_remove_deleted_config_dirs(self, listdir, spawn_n):
+        base_dir = ipsec_driver.cfg.CONF.ipsec.config_base_dir
+        listdir.return_value = [FAKE_ROUTER_ID,
+                                FAKE_ROUTER_ID + '.deleted-1234']
+        ipsec_driver.remove_deleted_config_dirs()
+        spawn_n.assert_called_once_with(
+            ipsec_driver._remove_dir,
+            os.path.join(base_dir, FAKE_ROUTER_ID + '.deleted-1234'))
+
+    @mock.patch('os.makedirs')
+    def test_ensure_config_dir(self, makedirs):
+        makedirs.side_effect = OSError(errno.EEXIST, 'File exists')
+        self.process.ensure_config_dir(None)
+        makedirs.assert_has_calls([
+            mock.call(os.path.join(self.process.config_dir, subdir), 0o755)
+            for subdir in self.process.CONFIG_DIRS])
+
+    @mock.patch('os.makedirs')
+    def test_ensure_config_dir_failure(self, makedirs):
+        makedirs.side_effect = OSError(errno.EACCES, 'Permission denied')
+        self.assertRaises(OSError, self.process.ensure_config_dir, None)
+
+    def test_disconnect(self):
+        self.process.vpnservice = FAKE_VPN_SERVICE
+        self.process.connection_status = {'abc123': {}, 'def456': {}}
+        with mock.patch.object(self.process, '_execute') as execute:
+            self.process.disconnect()
+        for conn_id in ('abc123', 'def456'):
+            execute.assert_any_call(['ipsec', 'whack',
+                                     '--ctlbase', self.process.pid_path,
+                                     '--name', '%s/0x1' % conn_id,
+                                     '--terminate'])
+        self.assertEqual(2, execute.call_count)
+
+    def test_disconnect_failure(self):
+        self.process.vpnservice = FAKE_VPN_SERVICE
+        self.process.connection_status = {'abc123': {}}
+        with mock.patch.object(self.process, '_execute',
+                               side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self.process.disconnect)
+
+    def _fake_execute(self, cmd, check_exit_code=True):
+        if cmd[:3] == ['ip', 'route', 'get']:
+            if cmd[3] == '60.0.0.2':
+                return '60.0.0.2 via 192.168.0.254 dev qg-1 src 192.168.0.1'
+            return '%s dev qg-1 src 192.168.0.1' % cmd[3]
+        return ''
+
+    def test_start_looks_up_nexthops(self):
+        self.process.vpnservice = {
+            'subnet': {'cidr': '10.0.0.0/24'},
+            'ipsec_site_connections': [
+                {'id': 'conn1', 'peer_address': '60.0.0.1',
+                 'peer_cidrs': ['20.0.0.0/24'], 'initiator': 'add'},
+                {'id': 'conn2', 'peer_address': '60.0.0.2',
+                 'peer_cidrs': ['30.0.0.0/24'], 'initiator': 'add'}]}
+        with mock.patch.object(self.process, '_execute',
+                               side_effect=self._fake_execute) as execute:
+            self.process.start()
+        for conn_id, nexthop in (('conn1', '60.0.0.1'),
+                                 ('conn2', '192.168.0.254')):
+            execute.assert_any_call(['ipsec', 'addconn',
+                                     '--ctlbase',
+                                     '%s.ctl' % self.process.pid_path,
+                                     '--defaultroutenexthop', nexthop,
+                                     '--config', self.process.config_file,
+                                     conn_id])
+
+    def test_get_nexthop(self):
+        with mock.patch.object(self.process, '_execute',
+                               side_effect=self._fake_execute):
+            self.assertEqual('192.168.0.254',
+                             self.process._get_nexthop('60.0.0.2'))
+            self.assertEqual('60.0.0.1',
+                             self.process._get_nexthop('60.0.0.1'))
+
+    def test_translate_dialect(self):
+        vpnservice = {
+            'ipsec_site_connections': [
+                {'initiator': 'bi-directional',
+                 'ikepolicy': {'ike_version': 'v1',
+                               'encryption_algorithm': 'aes-128',
+                               'auth_algorithm': 'sha1',
+                               'pfs': 'group5'},
+                 'ipsecpolicy': {'encryption_algorithm': '3des',
+                                 'auth_algorithm': 'sha1',
+                                 'pfs': 'group14'}}]}
+        self.process.update_vpnservice(vpnservice)
+        ipsec_site_conn = vpnservice['ipsec_site_connections'][0]
+        self.assertEqual('start', ipsec_site_conn['initiator'])
+        self.assertEqual({'ike_version': 'never',
+                          'encryption_algorithm': 'aes128',
+                          'auth_algorithm': 'sha1',
+                          'pfs': 'modp1536'},
+                         ipsec_site_conn['ikepolicy'])
+        self.assertEqual({'encryption_algorithm': '3des',
+                          'auth_algorithm': 'sha1',
+                          'pfs': 'modp2048'},
+                         ipsec_site_conn['ipsecpolicy'])
+
+    def test_virtual_privates(self):
+        self.process.vpnservice = {
+            'subnet': {'cidr': '10.0.0.0/24'},
+            'ipsec_site_connections': [
+                {'peer_cidrs': ['20.0.0.0/24', '2001:db8::/64']},
+                {'peer_cidrs': ['30.0.0.0/24']}]}
+        self.assertEqual('%v4:10.0.0.0/24,%v4:20.0.0.0/24,'
+                         '%v6:2001:db8::/64,%v4:30.0.0.0/24',
+                         self.process._virtual_privates())
+
+    def test_update_connection_status_keeps_pending_status(self):
+        self.process.connection_status = {
+            'abc123': {'status': constants.DOWN,
+                       'updated_pending_status': True}}
+        self.process._update_connection_status(
+            '000 "abc123/0x1": 10.0.0.0/24===192.168.0.1...'
+            '192.168.0.2===20.0.0.0/24; erouted; eroute owner: #2\n')
+        self.assertEqual({'abc123': {'status': constants.ACTIVE,
+                                     'updated_pending_status': True}},
+                         self.process.connection_status)
+
+    @mock.patch('neutron.agent.linux.utils.replace_file')
+    def test_ensure_config_file_skips_unchanged(self, replace_file):
+        with mock.patch.object(self.process, '_gen_config_content',
+                               return_value='config'):
+            self.process.ensure_config_file('ipsec.conf', 'template', None)
+            self.process.ensure_config_file('ipsec.conf', 'template', None)
+        replace_file.assert_called_once_with(
+            os.path.join(self.process.etc_dir, 'ipsec.conf'), 'config')
+
+    @mock.patch('os.path.isdir', return_value=False)
+    @mock.patch('neutron.agent.linux.utils.replace_file')
+    def test_ensure_config_file_after_remove_config(self, replace_file,
+                                                    isdir):
+        with mock.patch.object(self.process, '_gen_config_content',
+                               return_value='config'):
+            self.process.ensure_config_file('ipsec.conf', 'template', None)
+            self.process.remove_config()
+            self.process.ensure_config_file('ipsec.conf', 'template', None)
+        self.assertEqual(2, replace_file.call_count)
+
+    @mock.patch('os.path.exists', return_value=False)
+    def test_active_without_control_socket(self, exists):
+        with mock.patch.object(self.process, '_execute') as execute:
+            self.assertFalse(self.process.active)
+        exists.assert_called_once_with('%s.ctl' % self.process.pid_path)
+        self.assertFalse(execute.called)
+
+    @mock.patch('os.path.exists', return_value=True)
+    def test_active_with_control_socket(self, exists):
+        with mock.patch.object(self.process, '_execute',
+                               return_value='') as execute:
+            self.assertTrue(self.process.active)
+        self.assertTrue(execute.called)
+
+    def test_update_connection_status_does_not_span_lines(self):
+        self.process._update_connection_status(
+            '000 "abc123/0x1": 10.0.0.0/24===192.168.0.1...\n'
+            '000 192.168.0.2===20.0.0.0/24; erouted; eroute owner: #2\n')
+        self.assertEqual({}, self.process.connection_status)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_execute_reuses_ip_wrapper(self, ip_wrapper):
+        ip_wrapper.return_value.namespace = 'ns-fake'
+        self.process._execute(['ls'])
+        self.process._execute(['ls'])
+        ip_wrapper.assert_called_once_with('sudo', 'ns-fake')
+        self.assertEqual(2, ip_wrapper.return_value.netns.execute.call_count)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_execute_namespace_changed(self, ip_wrapper):
+        ip_wrapper.return_value.namespace = 'ns-fake'
+        self.process._execute(['ls'])
+        self.process.namespace = 'ns-other'
+        self.process._execute(['ls'])
+        ip_wrapper.assert_has_calls([mock.call('sudo', 'ns-fake'),
+                                     mock.call('sudo', 'ns-other')],
+                                    any_order=True)